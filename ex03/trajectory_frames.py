@@ -0,0 +1,454 @@
+"""Random access to DCD trajectory frames for interactive visualization.
+
+Writing a whole PDB file per frame and passing it to py3Dmol is slow and bloats
+notebooks. This module indexes the frames of a DCD file so that any frame can be
+read in O(1), extracts only the atoms of a selection (e.g. protein, ligand and
+the waters close to them) and serves them as compact multi-model PDB or binary
+payloads, either from an in-process generator or a small local HTTP endpoint.
+
+Example:
+    >>> server = FrameServer("topology.pdb", "traj.dcd", water_cutoff=5.0)
+    >>> view.addModelsAsFrames(server.to_pdb(server.frames(step=10)), "pdb")
+    >>> httpd = server.serve(port=8000)  # GET /info, GET /frames?start=0&step=10
+
+Requirements:
+    pip install numpy MDAnalysis --break-system-packages
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Iterator, Optional
+from urllib.parse import parse_qs, urlparse
+
+import MDAnalysis as mda
+import numpy as np
+from MDAnalysis.lib.distances import capped_distance
+
+# CHARMM time unit (AKMA) in picoseconds, used for the DCD timestep
+AKMA_TO_PS = 0.04888821
+
+# Magic bytes of the binary frame payload
+BINARY_MAGIC = b"DCDF"
+
+
+@dataclass
+class Frame:
+    """Data class to store the selected atoms of one trajectory frame."""
+
+    index: int
+    time: float
+    indices: np.ndarray
+    positions: np.ndarray
+
+
+class DCDIndex:
+    """Class to read DCD frames by index without scanning the file.
+
+    All frames of a DCD file have the same size, so the byte offset of every
+    frame follows from the header. The frames are memory mapped and exposed as
+    an array view, so reading a frame or a subset of its atoms only touches the
+    pages that hold them.
+    """
+
+    def __init__(self, filename: str):
+        """Read the DCD header and index the frames.
+
+        Args:
+            filename: Path to the DCD file
+
+        Raises:
+            ValueError: If the file is not a DCD file, has fixed atoms or no frames
+        """
+        self.filename = filename
+        with open(filename, "rb") as f:
+            header = f.read(4)
+            if struct.unpack("<i", header)[0] == 84:
+                self.endian = "<"
+            elif struct.unpack(">i", header)[0] == 84:
+                self.endian = ">"
+            else:
+                raise ValueError(f"{filename} is not a DCD file")
+
+            record = f.read(88)
+            if record[:4] != b"CORD":
+                raise ValueError(f"{filename} is not a DCD coordinate file")
+            icntrl = struct.unpack(f"{self.endian}20i", record[4:84])
+            self.first_step = icntrl[1]
+            self.interval = icntrl[2]
+            self.timestep = struct.unpack(f"{self.endian}f", record[40:44])[0]
+            if icntrl[8] != 0:
+                raise ValueError("DCD files with fixed atoms are not supported")
+            charmm = icntrl[19] != 0
+            self.has_cell = charmm and icntrl[10] == 1
+            has_4d = charmm and icntrl[11] == 1
+
+            # Skip the title record and read the number of atoms
+            (title_size,) = struct.unpack(f"{self.endian}i", f.read(4))
+            f.seek(title_size + 4, os.SEEK_CUR)
+            _, self.n_atoms, _ = struct.unpack(f"{self.endian}3i", f.read(12))
+            self.header_size = f.tell()
+
+        # Each record is wrapped in 4 byte length markers
+        self.coord_size = 4 * self.n_atoms + 8
+        self.cell_size = 56 if self.has_cell else 0
+        self.frame_size = self.cell_size + (4 if has_4d else 3) * self.coord_size
+
+        self._mmap = None
+        self._coords = None
+        self.refresh()
+
+    def refresh(self) -> int:
+        """Index the frames again, e.g. after frames were appended to the file.
+
+        A frame that is only partially written is ignored until it is complete.
+
+        Returns:
+            The number of frames
+
+        Raises:
+            ValueError: If the file does not contain any frames
+        """
+        n_frames = (
+            os.path.getsize(self.filename) - self.header_size
+        ) // self.frame_size
+        if n_frames == 0:
+            raise ValueError(f"{self.filename} does not contain any frames")
+
+        self.close()
+        self.n_frames = n_frames
+        self.offsets = self.header_size + self.frame_size * np.arange(self.n_frames)
+        with open(self.filename, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        frames = np.frombuffer(
+            self._mmap,
+            dtype=f"{self.endian}f4",
+            count=self.n_frames * self.frame_size // 4,
+            offset=self.header_size,
+        )
+        # View of shape (frame, xyz, atom) skipping the record markers
+        self._coords = np.lib.stride_tricks.as_strided(
+            frames[self.cell_size // 4 + 1 :],
+            shape=(self.n_frames, 3, self.n_atoms),
+            strides=(self.frame_size, self.coord_size, 4),
+            writeable=False,
+        )
+        return self.n_frames
+
+    def close(self):
+        """Release the memory map of the file."""
+        self._coords = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        """Return the index for use in a with statement."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the index at the end of a with statement."""
+        self.close()
+
+    def __len__(self) -> int:
+        """Return the number of frames."""
+        return self.n_frames
+
+    def time(self, frame: int) -> float:
+        """Return the simulation time of a frame in picoseconds."""
+        step = self.first_step + frame * self.interval
+        return float(step * self.timestep * AKMA_TO_PS)
+
+    def positions(self, frame: int, indices: Optional[np.ndarray] = None):
+        """Return the coordinates of a frame.
+
+        Args:
+            frame: Frame index, negative values count from the end
+            indices: Atom indices to read (default: all atoms)
+
+        Returns:
+            Coordinates in Angstrom with shape (atoms, 3) as float32
+        """
+        coords = self._coords[frame]
+        if indices is not None:
+            coords = coords[:, indices]
+        return np.ascontiguousarray(coords.T, dtype=np.float32)
+
+    def dimensions(self, frame: int) -> Optional[np.ndarray]:
+        """Return the unit cell of a frame.
+
+        Args:
+            frame: Frame index, negative values count from the end
+
+        Returns:
+            Unit cell as [A, B, C, alpha, beta, gamma] (Angstrom and degrees), or
+            None if the file has no unit cell information
+        """
+        if not self.has_cell:
+            return None
+        offset = self.offsets[frame] + 4
+        cell = np.frombuffer(
+            self._mmap, dtype=f"{self.endian}f8", count=6, offset=offset
+        )
+        a, gamma, b, beta, alpha, c = cell
+        angles = np.array([alpha, beta, gamma])
+        # Newer writers (e.g. OpenMM) store the cosines of the angles
+        if np.all(np.abs(angles) <= 1):
+            angles = np.degrees(np.arccos(angles))
+        return np.array([a, b, c, *angles], dtype=np.float32)
+
+
+class FrameServer:
+    """Class to serve selected atoms of trajectory frames as compact payloads."""
+
+    def __init__(
+        self,
+        topology: str,
+        trajectory: str,
+        selection: str = "protein",
+        water_cutoff: Optional[float] = None,
+        water_selection: str = "resname HOH WAT SOL TIP3",
+    ):
+        """Load the topology and index the trajectory.
+
+        Args:
+            topology: Topology file readable by MDAnalysis, e.g. "topology.pdb"
+            trajectory: DCD trajectory file, e.g. "traj.dcd"
+            selection: MDAnalysis selection of the atoms in every frame, e.g.
+                "protein or resname LIG" (default: "protein")
+            water_cutoff: Also include the waters with any atom within this
+                distance in Angstrom of the selection (default: None, no waters)
+            water_selection: MDAnalysis selection of the water atoms
+
+        Raises:
+            ValueError: If topology and trajectory have different numbers of atoms
+        """
+        self.universe = mda.Universe(topology)
+        self.index = DCDIndex(trajectory)
+        self._servers = []
+        atoms = self.universe.atoms
+        if atoms.n_atoms != self.index.n_atoms:
+            self.index.close()
+            raise ValueError(
+                f"Topology has {atoms.n_atoms} atoms, "
+                f"trajectory has {self.index.n_atoms} atoms"
+            )
+
+        self.selection = self.universe.select_atoms(selection).indices
+        self.water_cutoff = water_cutoff
+        waters = self.universe.select_atoms(water_selection)
+        waters = waters - self.universe.atoms[self.selection]
+        self.waters = waters.indices
+        self.water_resindices = waters.resindices
+
+        # The topology part of each PDB line does not change between frames
+        is_protein = np.zeros(atoms.n_atoms, dtype=bool)
+        is_protein[self.universe.select_atoms("protein").indices] = True
+        elements = (
+            atoms.elements
+            if hasattr(atoms, "elements")
+            else [name[0] for name in atoms.names]
+        )
+        chains = atoms.chainIDs if hasattr(atoms, "chainIDs") else [""] * len(atoms)
+        self._pdb_prefix = []
+        self._pdb_suffix = []
+        for i, atom in enumerate(atoms):
+            name = atom.name if len(atom.name) == 4 else f" {atom.name:<3}"
+            record = "ATOM  " if is_protein[i] else "HETATM"
+            self._pdb_prefix.append(
+                f"{record}{(i + 1) % 100000:5d} {name:4s} {atom.resname[:4]:<4s}"
+                f"{(chains[i] or ' ')[0]}{atom.resid % 10000:4d}    "
+            )
+            self._pdb_suffix.append(f"  1.00  0.00          {elements[i][:2]:>2s}")
+
+    def refresh(self) -> int:
+        """Index the frames again, e.g. after the simulation appended frames.
+
+        Returns:
+            The number of frames
+        """
+        return self.index.refresh()
+
+    def close(self):
+        """Stop the HTTP servers started by serve() and close the trajectory."""
+        for httpd in self._servers:
+            httpd.shutdown()
+            httpd.server_close()
+        self._servers = []
+        self.index.close()
+
+    def __enter__(self):
+        """Return the server for use in a with statement."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the server at the end of a with statement."""
+        self.close()
+
+    def __len__(self) -> int:
+        """Return the number of frames."""
+        return len(self.index)
+
+    def select(self, frame: int) -> np.ndarray:
+        """Return the indices of the atoms selected in a frame.
+
+        Args:
+            frame: Frame index, negative values count from the end
+
+        Returns:
+            Sorted atom indices: the selection and, if water_cutoff is set, all
+            atoms of the waters within the cutoff
+        """
+        if not self.water_cutoff or not len(self.waters):
+            return self.selection
+        pairs = capped_distance(
+            self.index.positions(frame, self.selection),
+            self.index.positions(frame, self.waters),
+            self.water_cutoff,
+            box=self.index.dimensions(frame),
+            return_distances=False,
+        )
+        close = np.isin(self.water_resindices, self.water_resindices[pairs[:, 1]])
+        return np.union1d(self.selection, self.waters[close])
+
+    def frame(self, frame: int) -> Frame:
+        """Return the selected atoms of a frame.
+
+        Args:
+            frame: Frame index, negative values count from the end
+
+        Returns:
+            Frame with atom indices and coordinates in Angstrom
+        """
+        frame = range(len(self))[frame]
+        indices = self.select(frame)
+        return Frame(
+            index=frame,
+            time=self.index.time(frame),
+            indices=indices,
+            positions=self.index.positions(frame, indices),
+        )
+
+    def frames(
+        self, start: int = 0, stop: Optional[int] = None, step: int = 1
+    ) -> Iterator[Frame]:
+        """Yield the selected atoms of a range of frames.
+
+        Args:
+            start: First frame (default: 0)
+            stop: Frame to stop before (default: None, the last frame)
+            step: Stride between frames (default: 1)
+
+        Yields:
+            Frame with atom indices and coordinates in Angstrom
+        """
+        for frame in range(len(self))[start:stop:step]:
+            yield self.frame(frame)
+
+    def to_pdb(self, frames: Iterable[Frame]) -> str:
+        """Return frames as a multi-model PDB string.
+
+        Args:
+            frames: Frames as returned by frame() or frames()
+
+        Returns:
+            PDB text with one MODEL per frame, e.g. for py3Dmol addModelsAsFrames
+        """
+        lines = []
+        for model, frame in enumerate(frames, 1):
+            lines.append(f"MODEL     {model:4d}")
+            for i, (x, y, z) in zip(frame.indices, frame.positions):
+                lines.append(
+                    f"{self._pdb_prefix[i]}{x:8.3f}{y:8.3f}{z:8.3f}{self._pdb_suffix[i]}"
+                )
+            lines.append("ENDMDL")
+        lines.append("END")
+        return "\n".join(lines) + "\n"
+
+    def to_binary(self, frames: Iterable[Frame]) -> bytes:
+        """Return frames as a compact binary payload.
+
+        The payload is little-endian: the magic bytes b"DCDF" and the number of
+        frames (uint32), then for each frame the frame index (uint32), time in
+        ps (float32), number of atoms (uint32), atom indices (int32) and
+        coordinates in Angstrom (float32, atoms x 3).
+
+        Args:
+            frames: Frames as returned by frame() or frames()
+
+        Returns:
+            Binary payload
+        """
+        chunks = []
+        for frame in frames:
+            chunks.append(
+                struct.pack("<IfI", frame.index, frame.time, len(frame.indices))
+            )
+            chunks.append(frame.indices.astype("<i4").tobytes())
+            chunks.append(frame.positions.astype("<f4").tobytes())
+        header = BINARY_MAGIC + struct.pack("<I", len(chunks) // 3)
+        return header + b"".join(chunks)
+
+    def serve(self, port: int = 8000, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve frames over HTTP from a background thread.
+
+        Endpoints:
+            GET /info: JSON with the number of frames and atoms
+            GET /frames?start=0&stop=100&step=10&format=pdb: frames as
+                multi-model PDB (format=pdb, default) or binary (format=bin)
+
+        Args:
+            port: Port to listen on (default: 8000)
+            host: Host to bind to (default: "127.0.0.1")
+
+        Returns:
+            The running server; close() stops it, or call shutdown() on it
+        """
+        server = self
+
+        class FrameRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                if url.path == "/info":
+                    info = {
+                        "n_frames": len(server),
+                        "n_atoms": server.index.n_atoms,
+                        "n_selected": len(server.selection),
+                        "water_cutoff": server.water_cutoff,
+                    }
+                    self.reply(json.dumps(info).encode(), "application/json")
+                elif url.path == "/frames":
+                    try:
+                        start = int(query.get("start", 0))
+                        stop = int(query["stop"]) if "stop" in query else None
+                        frames = server.frames(start, stop, int(query.get("step", 1)))
+                        if query.get("format", "pdb") == "bin":
+                            body = server.to_binary(frames)
+                            self.reply(body, "application/octet-stream")
+                        else:
+                            self.reply(server.to_pdb(frames).encode(), "chemical/x-pdb")
+                    except ValueError as e:
+                        self.send_error(400, str(e))
+                else:
+                    self.send_error(404)
+
+            def reply(self, body, content_type):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        httpd = ThreadingHTTPServer((host, port), FrameRequestHandler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        self._servers.append(httpd)
+        return httpd
@@ -5,17 +5,23 @@ This script searches for small protein structures by first finding UniProt entri
 with known ligands, then finding their PDB structures suitable for molecular
 dynamics simulations on a laptop computer.
 
+Usage:
+    python find_small_proteins_with_ligands.py [--metrics-json FILE]
+        [--prometheus FILE] [--profile]
+
 Requirements:
     pip install requests biopython pandas --break-system-packages
 """
 
-import time
+import argparse
 from dataclasses import dataclass
 from typing import Dict, List, Optional
 
 import pandas as pd
 import requests
 
+from instrumentation import Instrumentation, run_with_profile
+
 
 @dataclass
 class ProteinLigandComplex:
@@ -82,13 +88,17 @@ class UniProtLigandFinder:
         "oxide",
     }
 
-    def __init__(self, max_length: int = 300):
+    def __init__(
+        self, max_length: int = 300, metrics: Optional[Instrumentation] = None
+    ):
         """Initialize the finder.
 
         Args:
             max_length: Maximum protein length in amino acids
+            metrics: Instrumentation used to send and record requests
         """
         self.max_length = max_length
+        self.metrics = metrics if metrics is not None else Instrumentation()
 
     def is_organic_ligand(self, ligand_name: str) -> bool:
         """Check if a ligand is an organic molecule (not just an ion or water).
@@ -144,10 +154,12 @@ class UniProtLigandFinder:
 
         try:
             print("Searching UniProt for small enzymes with 3D structures...")
-            response = requests.get(self.UNIPROT_API, params=params)
+            response = self.metrics.get(
+                "uniprot/search", self.UNIPROT_API, params=params
+            )
             response.raise_for_status()
 
-            data = response.json()
+            data = self.metrics.json("uniprot/search", response)
             results = data.get("results", [])
 
             print(f"Got {len(results)} enzyme entries, filtering...")
@@ -213,15 +225,22 @@ class RCSBLigandFinder:
     BASE_URL = "https://search.rcsb.org/rcsbsearch/v2/query"
     DATA_API = "https://data.rcsb.org/rest/v1/core/entry"
 
-    def __init__(self, max_residues: int = 300, max_atoms: int = 50000):
+    def __init__(
+        self,
+        max_residues: int = 300,
+        max_atoms: int = 50000,
+        metrics: Optional[Instrumentation] = None,
+    ):
         """Initialize the finder with size constraints.
 
         Args:
             max_residues: Maximum number of protein residues (default: 300)
             max_atoms: Maximum total atoms for laptop simulation (default: 50000)
+            metrics: Instrumentation used to send and record requests
         """
         self.max_residues = max_residues
         self.max_atoms = max_atoms
+        self.metrics = metrics if metrics is not None else Instrumentation()
 
     def search_small_proteins_with_ligands(self, limit: int = 100) -> List[str]:
         """Search for small protein structures with bound ligands.
@@ -321,14 +340,15 @@ class RCSBLigandFinder:
                     "rows": rows,
                 }
 
-                response = requests.post(
+                response = self.metrics.post(
+                    "rcsb/search",
                     self.BASE_URL,
                     json=current_query,
                     headers={"Content-Type": "application/json"},
                 )
                 response.raise_for_status()
 
-                results = response.json()
+                results = self.metrics.json("rcsb/search", response)
                 result_set = results.get("result_set", [])
 
                 if not result_set:
@@ -344,7 +364,7 @@ class RCSBLigandFinder:
                     break
 
                 # Be nice to the API
-                time.sleep(0.3)
+                self.metrics.sleep(0.3)
 
             total_count = results.get("total_count", 0)
             print(
@@ -413,10 +433,10 @@ class RCSBLigandFinder:
         try:
             # First, get the entry to find nonpolymer entity IDs
             url = f"https://data.rcsb.org/rest/v1/core/entry/{pdb_id}"
-            response = requests.get(url)
+            response = self.metrics.get("core/entry", url)
 
             if response.status_code == 200:
-                data = response.json()
+                data = self.metrics.json("core/entry", response)
 
                 # Get the list of nonpolymer entity IDs
                 entity_ids = data.get("rcsb_entry_container_identifiers", {}).get(
@@ -426,10 +446,14 @@ class RCSBLigandFinder:
                 # For each entity, get its comp_id
                 for entity_id in entity_ids:
                     entity_url = f"https://data.rcsb.org/rest/v1/core/nonpolymer_entity/{pdb_id}/{entity_id}"
-                    entity_response = requests.get(entity_url)
+                    entity_response = self.metrics.get(
+                        "core/nonpolymer_entity", entity_url
+                    )
 
                     if entity_response.status_code == 200:
-                        entity_data = entity_response.json()
+                        entity_data = self.metrics.json(
+                            "core/nonpolymer_entity", entity_response
+                        )
                         comp_id = entity_data.get(
                             "rcsb_nonpolymer_entity_container_identifiers", {}
                         ).get("nonpolymer_comp_id", "")
@@ -438,7 +462,7 @@ class RCSBLigandFinder:
                         if comp_id and comp_id not in common_solvents:
                             ligands.append(comp_id)
 
-                    time.sleep(0.05)  # Be nice to the API
+                    self.metrics.sleep(0.05)  # Be nice to the API
 
             # Remove duplicates
             ligands = list(set(ligands))
@@ -459,9 +483,9 @@ class RCSBLigandFinder:
         """
         try:
             url = f"{self.DATA_API}/{pdb_id}"
-            response = requests.get(url)
+            response = self.metrics.get("core/entry", url)
             response.raise_for_status()
-            data = response.json()
+            data = self.metrics.json("core/entry", response)
 
             # Extract basic information
             title = data.get("struct", {}).get("title", "N/A")
@@ -492,9 +516,9 @@ class RCSBLigandFinder:
             # Get polymer entities for residue count
             polymer_url = f"https://data.rcsb.org/rest/v1/core/polymer_entity/{pdb_id}"
             try:
-                poly_response = requests.get(polymer_url)
+                poly_response = self.metrics.get("core/polymer_entity", polymer_url)
                 if poly_response.status_code == 200:
-                    poly_data = poly_response.json()
+                    poly_data = self.metrics.json("core/polymer_entity", poly_response)
                     # Count total residues from all protein entities
                     if isinstance(poly_data, dict):
                         poly_entities = poly_data.get("rcsb_polymer_entity", [])
@@ -508,7 +532,8 @@ class RCSBLigandFinder:
                 pass
 
             # Get ligand information using dedicated method
-            ligands = self.get_ligands(pdb_id)
+            with self.metrics.stage("get_ligands"):
+                ligands = self.get_ligands(pdb_id)
 
             # Get organism
             organism = "Unknown"
@@ -554,14 +579,16 @@ class RCSBLigandFinder:
         )
         print("-" * 70)
 
-        pdb_ids = self.search_small_proteins_with_ligands(limit=num_results)
+        with self.metrics.stage("rcsb_search"):
+            pdb_ids = self.search_small_proteins_with_ligands(limit=num_results)
 
         suitable_complexes = []
 
         for i, pdb_id in enumerate(pdb_ids, 1):
             print(f"Processing {i}/{len(pdb_ids)}: {pdb_id}...", end=" ")
 
-            complex_info = self.get_structure_details(pdb_id)
+            with self.metrics.stage("structure_details"):
+                complex_info = self.get_structure_details(pdb_id)
 
             if complex_info and complex_info.ligands:
                 if complex_info.is_laptop_suitable(self.max_atoms):
@@ -589,7 +616,7 @@ class RCSBLigandFinder:
                 print("✗ No ligands or data unavailable")
 
             # Be nice to the API
-            time.sleep(0.2)
+            self.metrics.sleep(0.2)
 
         df = pd.DataFrame(suitable_complexes)
 
@@ -599,8 +626,12 @@ class RCSBLigandFinder:
         return df
 
 
-def main():
-    """Main execution function."""
+def run_screen(metrics: Instrumentation):
+    """Search UniProt and RCSB PDB for suitable complexes and save them to CSV.
+
+    Args:
+        metrics: Instrumentation used to send and record requests
+    """
     print("=" * 70)
     print("RCSB PDB Small Protein-Ligand Complex Finder (via UniProt)")
     print("=" * 70)
@@ -612,8 +643,9 @@ def main():
     NUM_PROTEINS = 100  # Number of UniProt entries to search
 
     # Step 1: Search UniProt for proteins with known ligands
-    uniprot_finder = UniProtLigandFinder(max_length=MAX_LENGTH)
-    proteins = uniprot_finder.search_proteins_with_ligands(limit=NUM_PROTEINS)
+    uniprot_finder = UniProtLigandFinder(max_length=MAX_LENGTH, metrics=metrics)
+    with metrics.stage("uniprot_search"):
+        proteins = uniprot_finder.search_proteins_with_ligands(limit=NUM_PROTEINS)
 
     if not proteins:
         print("No proteins found in UniProt. Exiting.")
@@ -623,66 +655,70 @@ def main():
     print("-" * 70)
 
     # Step 2: For each protein, get PDB structures and check suitability
-    pdb_finder = RCSBLigandFinder(max_residues=MAX_LENGTH, max_atoms=MAX_ATOMS)
+    pdb_finder = RCSBLigandFinder(
+        max_residues=MAX_LENGTH, max_atoms=MAX_ATOMS, metrics=metrics
+    )
     suitable_complexes = []
 
-    for i, protein_info in enumerate(proteins, 1):
-        uniprot_id = protein_info["uniprot_id"]
-        protein_name = protein_info["protein_name"]
-        pdb_ids = protein_info["pdb_ids"][
-            :5
-        ]  # Check up to 5 PDB structures per protein
-        known_ligands = protein_info["known_ligands"]
-
-        print(f"\n[{i}/{len(proteins)}] {uniprot_id}: {protein_name[:60]}")
-        print(f"  Known ligands: {', '.join(known_ligands[:3])}")
-        print(f"  PDB structures: {', '.join(pdb_ids)}")
-
-        for pdb_id in pdb_ids:
-            print(f"    Checking {pdb_id}...", end=" ")
-
-            complex_info = pdb_finder.get_structure_details(pdb_id)
-
-            if complex_info:
-                if complex_info.is_laptop_suitable(MAX_ATOMS):
-                    # Check if structure has ligands
-                    if complex_info.ligands:
-                        suitable_complexes.append(
-                            {
-                                "PDB_ID": complex_info.pdb_id,
-                                "UniProt_ID": uniprot_id,
-                                "Protein_Name": protein_name[:60],
-                                "Title": complex_info.title[:60] + "..."
-                                if len(complex_info.title) > 60
-                                else complex_info.title,
-                                "Resolution_Å": complex_info.resolution,
-                                "Method": complex_info.method,
-                                "Num_Atoms": complex_info.num_atoms,
-                                "Num_Residues": complex_info.num_residues,
-                                "Ligands": ", ".join(complex_info.ligands[:5]),
-                                "Known_Cofactors": ", ".join(known_ligands[:3]),
-                                "Organism": complex_info.organism[:40],
-                            }
-                        )
-                        print(
-                            f"✓ Suitable! ({complex_info.num_atoms} atoms, ligands: {', '.join(complex_info.ligands[:3])})"
-                        )
+    with metrics.stage("pdb_screening"):
+        for i, protein_info in enumerate(proteins, 1):
+            uniprot_id = protein_info["uniprot_id"]
+            protein_name = protein_info["protein_name"]
+            pdb_ids = protein_info["pdb_ids"][
+                :5
+            ]  # Check up to 5 PDB structures per protein
+            known_ligands = protein_info["known_ligands"]
+
+            print(f"\n[{i}/{len(proteins)}] {uniprot_id}: {protein_name[:60]}")
+            print(f"  Known ligands: {', '.join(known_ligands[:3])}")
+            print(f"  PDB structures: {', '.join(pdb_ids)}")
+
+            for pdb_id in pdb_ids:
+                print(f"    Checking {pdb_id}...", end=" ")
+
+                with metrics.stage("structure_details"):
+                    complex_info = pdb_finder.get_structure_details(pdb_id)
+
+                if complex_info:
+                    if complex_info.is_laptop_suitable(MAX_ATOMS):
+                        # Check if structure has ligands
+                        if complex_info.ligands:
+                            suitable_complexes.append(
+                                {
+                                    "PDB_ID": complex_info.pdb_id,
+                                    "UniProt_ID": uniprot_id,
+                                    "Protein_Name": protein_name[:60],
+                                    "Title": complex_info.title[:60] + "..."
+                                    if len(complex_info.title) > 60
+                                    else complex_info.title,
+                                    "Resolution_Å": complex_info.resolution,
+                                    "Method": complex_info.method,
+                                    "Num_Atoms": complex_info.num_atoms,
+                                    "Num_Residues": complex_info.num_residues,
+                                    "Ligands": ", ".join(complex_info.ligands[:5]),
+                                    "Known_Cofactors": ", ".join(known_ligands[:3]),
+                                    "Organism": complex_info.organism[:40],
+                                }
+                            )
+                            print(
+                                f"✓ Suitable! ({complex_info.num_atoms} atoms, ligands: {', '.join(complex_info.ligands[:3])})"
+                            )
+                        else:
+                            print("✗ No ligands detected")
                     else:
-                        print("✗ No ligands detected")
+                        print(f"✗ Too large ({complex_info.num_atoms} atoms)")
                 else:
-                    print(f"✗ Too large ({complex_info.num_atoms} atoms)")
-            else:
-                print("✗ Data unavailable")
+                    print("✗ Data unavailable")
 
-            # Be nice to the APIs
-            time.sleep(0.3)
+                # Be nice to the APIs
+                metrics.sleep(0.3)
 
-        # Stop if we have enough suitable structures
-        if len(suitable_complexes) >= 50:
-            print(
-                f"\nFound {len(suitable_complexes)} suitable structures. Stopping search."
-            )
-            break
+            # Stop if we have enough suitable structures
+            if len(suitable_complexes) >= 50:
+                print(
+                    f"\nFound {len(suitable_complexes)} suitable structures. Stopping search."
+                )
+                break
 
     # Display results
     print()
@@ -691,39 +727,78 @@ def main():
     print("=" * 70)
     print()
 
-    if suitable_complexes:
-        df = pd.DataFrame(suitable_complexes)
-        df = df.sort_values("Num_Atoms")
+    with metrics.stage("report"):
+        if suitable_complexes:
+            df = pd.DataFrame(suitable_complexes)
+            df = df.sort_values("Num_Atoms")
 
-        # Display summary
-        print(df.to_string(index=False))
+            # Display summary
+            print(df.to_string(index=False))
 
-        # Save to CSV
-        output_file = "suitable_protein_ligand_complexes.csv"
-        df.to_csv(output_file, index=False)
-        print()
-        print(f"Results saved to: {output_file}")
+            # Save to CSV
+            output_file = "suitable_protein_ligand_complexes.csv"
+            df.to_csv(output_file, index=False)
+            print()
+            print(f"Results saved to: {output_file}")
 
-        # Print some statistics
-        print()
-        print("Statistics:")
-        print(f"  Average atoms: {df['Num_Atoms'].mean():.0f}")
-        print(
-            f"  Smallest structure: {df['PDB_ID'].iloc[0]} ({df['Num_Atoms'].iloc[0]} atoms)"
-        )
-        print(
-            f"  Largest structure: {df['PDB_ID'].iloc[-1]} ({df['Num_Atoms'].iloc[-1]} atoms)"
-        )
-        print(f"  Unique proteins: {df['UniProt_ID'].nunique()}")
+            # Print some statistics
+            print()
+            print("Statistics:")
+            print(f"  Average atoms: {df['Num_Atoms'].mean():.0f}")
+            print(
+                f"  Smallest structure: {df['PDB_ID'].iloc[0]} ({df['Num_Atoms'].iloc[0]} atoms)"
+            )
+            print(
+                f"  Largest structure: {df['PDB_ID'].iloc[-1]} ({df['Num_Atoms'].iloc[-1]} atoms)"
+            )
+            print(f"  Unique proteins: {df['UniProt_ID'].nunique()}")
 
-        # Print download instructions
-        print()
-        print("To download a structure:")
-        print("  wget https://files.rcsb.org/download/[PDB_ID].pdb")
-        print("  Example: wget https://files.rcsb.org/download/1ABC.pdb")
+            # Print download instructions
+            print()
+            print("To download a structure:")
+            print("  wget https://files.rcsb.org/download/[PDB_ID].pdb")
+            print("  Example: wget https://files.rcsb.org/download/1ABC.pdb")
+
+        else:
+            print("No suitable complexes found. Try adjusting the search parameters.")
 
-    else:
-        print("No suitable complexes found. Try adjusting the search parameters.")
+
+def main():
+    """Main execution function."""
+    parser = argparse.ArgumentParser(
+        description="Find small protein-ligand complexes suitable for MD simulations."
+    )
+    parser.add_argument(
+        "--metrics-json",
+        default="screening_metrics.json",
+        metavar="FILE",
+        help="File for the JSON metrics report (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--prometheus",
+        metavar="FILE",
+        help="Also write the metrics in the Prometheus text format to FILE",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Run under cProfile and tracemalloc and print the top hotspots",
+    )
+    args = parser.parse_args()
+
+    metrics = Instrumentation()
+    try:
+        if args.profile:
+            run_with_profile(run_screen, metrics)
+        else:
+            run_screen(metrics)
+    finally:
+        metrics.write_json(args.metrics_json)
+        print()
+        print(f"Metrics report saved to: {args.metrics_json}")
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+            print(f"Prometheus metrics saved to: {args.prometheus}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,443 @@
+"""Instrumentation for the RCSB PDB and UniProt screening script.
+
+Records per-endpoint request counts, latencies, bytes transferred, retries and
+errors, the time spent sleeping between requests and in retry backoff, and the
+wall time of each stage of a screen. Bytes are counted as transferred, i.e.
+request bodies as sent and response bodies before decompression (HTTP headers
+are not included). The results can be written as a JSON report or in the
+Prometheus text format, and a screen can be run under cProfile and tracemalloc
+to find hotspots.
+
+Requirements:
+    pip install requests numpy --break-system-packages
+"""
+
+import cProfile
+import json
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# HTTP status codes that are retried with exponential backoff
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TimedRetry(Retry):
+    """Retry configuration that reports each retry and the time slept before it.
+
+    urllib3 retries failed connections and error responses and sleeps for the
+    exponential backoff or the Retry-After header of a response inside
+    requests.Session.request, so this time is part of the request latency. The
+    callbacks make the retries visible even if the request fails in the end.
+    """
+
+    def __init__(
+        self,
+        *args,
+        on_retry: Optional[Callable] = None,
+        on_sleep: Optional[Callable] = None,
+        **kwargs,
+    ):
+        """Initialize the retry configuration.
+
+        Args:
+            *args: Arguments passed to urllib3.util.retry.Retry
+            on_retry: Function called without arguments before each retry
+            on_sleep: Function called with the seconds slept before each retry
+            **kwargs: Keyword arguments passed to urllib3.util.retry.Retry
+        """
+        super().__init__(*args, **kwargs)
+        self.on_retry = on_retry
+        self.on_sleep = on_sleep
+
+    def new(self, **kwargs) -> "TimedRetry":
+        """Return a copy with updated counters, keeping the callbacks."""
+        retry = super().new(**kwargs)
+        retry.on_retry = self.on_retry
+        retry.on_sleep = self.on_sleep
+        return retry
+
+    def increment(self, *args, **kwargs) -> "TimedRetry":
+        """Count a failed attempt and report it if it will be retried.
+
+        Raises:
+            urllib3.exceptions.MaxRetryError: If no retries are left
+        """
+        retry = super().increment(*args, **kwargs)
+        if self.on_retry is not None:
+            self.on_retry()
+        return retry
+
+    def sleep(self, response=None):
+        """Sleep before a retry and report the time spent."""
+        start = time.perf_counter()
+        super().sleep(response)
+        if self.on_sleep is not None:
+            self.on_sleep(time.perf_counter() - start)
+
+
+@dataclass
+class EndpointStats:
+    """Data class to store the request statistics of one API endpoint."""
+
+    requests: int = 0
+    errors: int = 0
+    retries: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    retry_sleep_seconds: float = 0.0
+    json_seconds: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+
+    def percentile(self, q: float) -> float:
+        """Return a latency percentile in seconds (0 if there were no requests)."""
+        if not self.latencies:
+            return 0.0
+        return float(np.percentile(self.latencies, q))
+
+    def histogram(self) -> Dict[str, int]:
+        """Return the cumulative number of requests per latency bucket."""
+        latencies = np.asarray(self.latencies)
+        counts = {str(le): int((latencies <= le).sum()) for le in LATENCY_BUCKETS}
+        counts["+Inf"] = len(self.latencies)
+        return counts
+
+    def to_dict(self) -> Dict:
+        """Return the statistics as a JSON serializable dictionary."""
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "retry_sleep_seconds": round(self.retry_sleep_seconds, 6),
+            "json_seconds": round(self.json_seconds, 6),
+            "latency_seconds": {
+                "total": round(sum(self.latencies), 6),
+                "p50": round(self.percentile(50), 6),
+                "p95": round(self.percentile(95), 6),
+                "p99": round(self.percentile(99), 6),
+                "max": round(max(self.latencies, default=0.0), 6),
+                "histogram": self.histogram(),
+            },
+        }
+
+
+class Instrumentation:
+    """Class to send API requests and record where the time of a screen goes."""
+
+    def __init__(self, max_retries: int = 3, backoff_factor: float = 0.5):
+        """Initialize the HTTP session and empty metrics.
+
+        Args:
+            max_retries: Maximum retries of failed requests (default: 3)
+            backoff_factor: Backoff factor in seconds between retries (default: 0.5)
+        """
+        retry = TimedRetry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=None,  # The search API queries are sent with POST
+            raise_on_status=False,
+            on_retry=self._record_retry,
+            on_sleep=self._record_retry_sleep,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(max_retries=retry))
+        self.session.mount("http://", HTTPAdapter(max_retries=retry))
+
+        self.start_time = time.perf_counter()
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.sleep_calls = 0
+        self.sleep_seconds = 0.0
+        self.retries = 0
+        self.retry_sleep_calls = 0
+        self.retry_sleep_seconds = 0.0
+
+    def _record_retry(self):
+        """Record that urllib3 retries a request."""
+        self.retries += 1
+
+    def _record_retry_sleep(self, seconds: float):
+        """Record the time urllib3 slept before retrying a request."""
+        self.retry_sleep_calls += 1
+        self.retry_sleep_seconds += seconds
+
+    def request(
+        self, method: str, endpoint: str, url: str, **kwargs
+    ) -> requests.Response:
+        """Send a request and record its statistics.
+
+        Retries are counted per attempt, also if the request fails in the end.
+        The latency includes the time spent sleeping between retries, which is
+        also recorded separately as retry_sleep_seconds. The request body is
+        counted once per request and the received bytes are counted before the
+        response body is decompressed.
+
+        Args:
+            method: HTTP method, e.g. "GET" or "POST"
+            endpoint: Name under which the request is recorded, e.g. "core/entry"
+            url: Request URL
+            **kwargs: Further arguments passed to requests.Session.request
+
+        Returns:
+            The response; responses with an error status are returned as well
+
+        Raises:
+            requests.exceptions.RequestException: If the request failed
+        """
+        stats = self.endpoints.setdefault(endpoint, EndpointStats())
+        stats.requests += 1
+
+        retries = self.retries
+        retry_sleep_seconds = self.retry_sleep_seconds
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            stats.latencies.append(time.perf_counter() - start)
+            stats.retries += self.retries - retries
+            stats.retry_sleep_seconds += self.retry_sleep_seconds - retry_sleep_seconds
+            if e.request is not None:
+                stats.bytes_sent += len(e.request.body or b"")
+            stats.errors += 1
+            raise
+        stats.latencies.append(time.perf_counter() - start)
+        stats.retries += self.retries - retries
+        stats.retry_sleep_seconds += self.retry_sleep_seconds - retry_sleep_seconds
+
+        stats.bytes_sent += len(response.request.body or b"")
+        # Read the body, then ask urllib3 how many (compressed) bytes it read
+        content = response.content
+        try:
+            stats.bytes_received += response.raw.tell()
+        except (AttributeError, OSError):
+            stats.bytes_received += len(content)
+        if not response.ok:
+            stats.errors += 1
+
+        return response
+
+    def get(self, endpoint: str, url: str, **kwargs) -> requests.Response:
+        """Send a GET request, see request()."""
+        return self.request("GET", endpoint, url, **kwargs)
+
+    def post(self, endpoint: str, url: str, **kwargs) -> requests.Response:
+        """Send a POST request, see request()."""
+        return self.request("POST", endpoint, url, **kwargs)
+
+    def json(self, endpoint: str, response: requests.Response):
+        """Parse a JSON response and record the parsing time.
+
+        Args:
+            endpoint: Name under which the request was recorded
+            response: Response returned by request()
+
+        Returns:
+            The decoded JSON data
+        """
+        start = time.perf_counter()
+        data = response.json()
+        stats = self.endpoints.setdefault(endpoint, EndpointStats())
+        stats.json_seconds += time.perf_counter() - start
+        return data
+
+    def sleep(self, seconds: float):
+        """Sleep (e.g. to be nice to an API) and record the time spent."""
+        time.sleep(seconds)
+        self.sleep_calls += 1
+        self.sleep_seconds += seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the wall time of a stage of the screen.
+
+        Stages may be nested and entered repeatedly; calls and wall time are
+        accumulated per stage name.
+
+        Args:
+            name: Stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+            stage["calls"] += 1
+            stage["seconds"] += time.perf_counter() - start
+
+    def report(self) -> Dict:
+        """Return all metrics as a JSON serializable dictionary."""
+        return {
+            "wall_seconds": round(time.perf_counter() - self.start_time, 6),
+            "sleep": {
+                "calls": self.sleep_calls,
+                "seconds": round(self.sleep_seconds, 6),
+                "retry_calls": self.retry_sleep_calls,
+                "retry_seconds": round(self.retry_sleep_seconds, 6),
+            },
+            "stages": {
+                name: {"calls": stage["calls"], "seconds": round(stage["seconds"], 6)}
+                for name, stage in self.stages.items()
+            },
+            "endpoints": {
+                name: stats.to_dict() for name, stats in self.endpoints.items()
+            },
+        }
+
+    def to_prometheus(self, prefix: str = "screening") -> str:
+        """Return all metrics in the Prometheus text exposition format.
+
+        Args:
+            prefix: Prefix of the metric names (default: "screening")
+
+        Returns:
+            Metrics as text
+        """
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{prefix}_{name}{suffix}{label_text} {value}")
+
+        endpoints = self.endpoints.items()
+        metric(
+            "http_requests_total",
+            "counter",
+            "Number of HTTP requests per endpoint.",
+            [("", {"endpoint": name}, s.requests) for name, s in endpoints],
+        )
+        metric(
+            "http_errors_total",
+            "counter",
+            "Number of failed HTTP requests per endpoint.",
+            [("", {"endpoint": name}, s.errors) for name, s in endpoints],
+        )
+        metric(
+            "http_retries_total",
+            "counter",
+            "Number of HTTP request retry attempts per endpoint.",
+            [("", {"endpoint": name}, s.retries) for name, s in endpoints],
+        )
+        metric(
+            "http_sent_bytes_total",
+            "counter",
+            "Bytes sent in HTTP request bodies per endpoint (headers excluded).",
+            [("", {"endpoint": name}, s.bytes_sent) for name, s in endpoints],
+        )
+        metric(
+            "http_received_bytes_total",
+            "counter",
+            "Bytes received in HTTP response bodies before decompression per "
+            "endpoint (headers excluded).",
+            [("", {"endpoint": name}, s.bytes_received) for name, s in endpoints],
+        )
+        metric(
+            "http_retry_sleep_seconds_total",
+            "counter",
+            "Time spent sleeping before retries (backoff and Retry-After) per "
+            "endpoint, included in the request latency.",
+            [("", {"endpoint": name}, s.retry_sleep_seconds) for name, s in endpoints],
+        )
+        metric(
+            "json_parse_seconds_total",
+            "counter",
+            "Time spent parsing JSON responses per endpoint.",
+            [("", {"endpoint": name}, s.json_seconds) for name, s in endpoints],
+        )
+
+        samples = []
+        for name, stats in endpoints:
+            for le, count in stats.histogram().items():
+                samples.append(("_bucket", {"endpoint": name, "le": le}, count))
+            samples.append(("_sum", {"endpoint": name}, sum(stats.latencies)))
+            samples.append(("_count", {"endpoint": name}, len(stats.latencies)))
+        metric(
+            "http_request_duration_seconds",
+            "histogram",
+            "HTTP request latency per endpoint, including retries.",
+            samples,
+        )
+
+        metric(
+            "sleep_seconds_total",
+            "counter",
+            "Time spent sleeping between API requests, excluding retries.",
+            [("", {}, self.sleep_seconds)],
+        )
+        metric(
+            "stage_seconds_total",
+            "counter",
+            "Wall time per stage of the screen.",
+            [("", {"stage": n}, s["seconds"]) for n, s in self.stages.items()],
+        )
+        metric(
+            "wall_seconds",
+            "gauge",
+            "Wall time since the start of the screen.",
+            [("", {}, time.perf_counter() - self.start_time)],
+        )
+
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, filename: str):
+        """Write the JSON report to a file."""
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_prometheus(self, filename: str):
+        """Write the metrics in the Prometheus text format to a file."""
+        with open(filename, "w") as f:
+            f.write(self.to_prometheus())
+
+
+def run_with_profile(
+    func: Callable, *args, output_file: str = "screening.prof", top: int = 25
+):
+    """Run a function under cProfile and tracemalloc and print the hotspots.
+
+    Args:
+        func: Function to run
+        *args: Arguments passed to the function
+        output_file: File for the cProfile statistics (default: "screening.prof")
+        top: Number of functions and allocation sites to print (default: 25)
+
+    Returns:
+        The return value of the function
+    """
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        profiler.dump_stats(output_file)
+
+        print()
+        print("=" * 70)
+        print(f"Top {top} functions by cumulative time (saved to {output_file})")
+        print("=" * 70)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+
+        print("=" * 70)
+        print(f"Top {top} memory allocations")
+        print("=" * 70)
+        for stat in snapshot.statistics("lineno")[:top]:
+            print(f"  {stat}")